@@ -0,0 +1,183 @@
+"""
+Generate many timesheets and portfolios from a job manifest.
+
+    python batch.py jobs.json --workers 8 --summary summary.json
+
+The manifest is a JSON list of jobs, or a CSV file with one job per row
+and the fields below as columns (photos separated by ';'):
+
+    kind      'timesheet' or 'portfolio'
+    output    PDF path to write
+    sessions  timesheet: CSV or SQLite session file (sample rows if empty)
+    client, since, until
+              timesheet: narrow the sessions to one client and period
+    contractedHours
+              timesheet: hours the summary subtracts from, 120 by default
+    photos    portfolio: photo paths, in page order
+    passthroughSlack
+              portfolio: how much larger than needed an original JPEG may
+              be and still be embedded as-is, see imageprep.passthroughSlack
+    trace     where to write a Chrome trace of the build's phases; the
+              phase timings and counts are added to the job's result too
+    memory    true (true, 1 or yes in CSV) to also record peak memory per
+              phase and the largest allocations, see
+              buildcontrol.BuildTrace; slows the build
+
+Jobs run in a pool of worker processes. Each PDF is written next to its
+output path first and only renamed into place once complete, so a failed
+or interrupted job never leaves a partial file behind.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from buildcontrol import BuildTrace, formatStats
+from createportfolio import BasicPortfolio
+from imageprep import passthroughSlack
+from pdf_timesheet import PDFPSReporte
+from sessionsource import openSessionSource
+
+
+def readManifest(path):
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            jobs = [dict((k, v) for k, v in row.items() if v) for row in csv.DictReader(f)]
+        for job in jobs:
+            if 'photos' in job:
+                job['photos'] = job['photos'].split(';')
+        return jobs
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def jobFlag(job, name):
+    # CSV manifests give strings, so "false" and "0" must not count as set
+    value = job.get(name)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    return isinstance(value, (bool, int)) and bool(value)
+
+
+def buildReport(job, path, trace=None):
+    # Returns the page count
+    kind = job.get('kind', 'timesheet')
+    if kind == 'timesheet':
+        sessions = None
+        if job.get('sessions'):
+            since, until = (date.fromisoformat(job[k]) if job.get(k) else None for k in ('since', 'until'))
+            sessions = openSessionSource(job['sessions'], job.get('client'), since, until)
+        report = PDFPSReporte(path, sessions=sessions, contractedHours=float(job.get('contractedHours', 120)),
+                              trace=trace)
+    elif kind == 'portfolio':
+        # The processes already fill the cores, one photo thread each is enough
+        report = BasicPortfolio(path, job['photos'], workers=1, trace=trace,
+                                passthroughSlack=float(job.get('passthroughSlack', passthroughSlack)))
+    else:
+        raise ValueError('unknown job kind %r' % kind)
+    return report.doc.page
+
+
+def runJob(job):
+    """Build one job into its output path; runs in a worker process."""
+    output = job['output']
+    result = {'output': output, 'kind': job.get('kind', 'timesheet'), 'ok': False}
+    directory = os.path.dirname(os.path.abspath(output))
+    tmp = os.path.join(directory, '.%s.%s.tmp' % (os.path.basename(output), os.getpid()))
+    memory = jobFlag(job, 'memory')
+    trace = BuildTrace(memory=memory) if job.get('trace') or memory else None
+    started, cpuStarted = time.perf_counter(), time.process_time()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        result['pages'] = buildReport(job, tmp, trace)
+        os.replace(tmp, output)
+        result['bytes'] = os.path.getsize(output)
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    result['cpuSeconds'] = round(time.process_time() - cpuStarted, 3)
+    if trace is not None:
+        # Also kept for failed builds, to see how far they got
+        trace.stop()
+        result.update(trace.stats())
+        if job.get('trace'):
+            trace.writeTrace(job['trace'])
+    return result
+
+
+def runBatch(jobs, workers=None, log=None):
+    """Run jobs across workers processes (CPU count by default); results in manifest order."""
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(runJob, job), i) for i, job in enumerate(jobs))
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if log is not None:
+                log(result)
+    return results
+
+
+def writeSummary(path, results, seconds, workers):
+    summary = {
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'jobs': len(results),
+        'failed': sum(1 for r in results if not r['ok']),
+        'bytes': sum(r.get('bytes', 0) for r in results),
+        'results': results,
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, path)
+    return summary
+
+
+def printResult(result):
+    if result['ok']:
+        print('%-40s %4d pages %9d bytes %7.2fs' % (result['output'], result['pages'], result['bytes'],
+                                                     result['seconds']))
+    else:
+        print('%-40s FAILED %s' % (result['output'], result['error']))
+    if 'phases' in result:
+        print('    ' + formatStats(result).replace('\n', '\n    '))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate timesheets and portfolios from a job manifest.')
+    parser.add_argument('manifest', help='JSON or CSV job manifest')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('-s', '--summary', default='batch-summary.json',
+                        help='where to write per-job timings and sizes (default: %(default)s)')
+    parser.add_argument('-t', '--trace', action='store_true',
+                        help='time every build phase, with a Chrome trace next to each output')
+    parser.add_argument('-m', '--memory', action='store_true',
+                        help='also record peak memory per phase and the largest allocations (slower)')
+    args = parser.parse_args(argv)
+
+    jobs = readManifest(args.manifest)
+    for job in jobs:
+        if args.trace:
+            job.setdefault('trace', job['output'] + '.trace.json')
+        if args.memory:
+            job.setdefault('memory', True)
+    started = time.perf_counter()
+    results = runBatch(jobs, args.workers, printResult)
+    summary = writeSummary(args.summary, results, time.perf_counter() - started, args.workers)
+    print('%d jobs, %d failed, %d bytes in %.1fs' % (summary['jobs'], summary['failed'], summary['bytes'],
+                                                      summary['seconds']))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
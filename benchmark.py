@@ -0,0 +1,177 @@
+"""
+Benchmark timesheet and portfolio generation on fixed workloads.
+
+    python benchmark.py                      run everything, compare with the baseline
+    python benchmark.py --only portfolio     run the portfolio workloads only
+    python benchmark.py --save-baseline      run and store the results as the new baseline
+
+Each workload is built in a fresh process that reports wall and CPU
+seconds, peak RSS, output bytes and pages per second. The results go to
+benchmark-results.json. Wall, CPU, RSS and byte figures more than
+--threshold above benchmark-baseline.json are flagged as regressions and
+make the exit status non-zero.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS is not reported there
+    resource = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (kind, sessions or photos)
+workloads = {
+    'timesheet-10': ('timesheet', 10),
+    'timesheet-1k': ('timesheet', 1000),
+    'timesheet-100k': ('timesheet', 100000),
+    'portfolio-10': ('portfolio', 10),
+    'portfolio-100': ('portfolio', 100),
+    'portfolio-1000': ('portfolio', 1000),
+}
+photos = ['static/cat%d.jpg' % i for i in range(1, 10)]
+# Lower is better for all of these
+compared = ['seconds', 'cpuSeconds', 'peakRss', 'bytes']
+
+
+def writeSessions(path, count, seed=2019):
+    # Same sessions every time for a given count
+    rng = random.Random(seed)
+    types = ['remote', 'remote', 'onsite', 'documentation']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['client', 'date', 'start', 'end', 'type'])
+        for i in range(count):
+            start = rng.randrange(7 * 60, 18 * 60)
+            end = start + rng.randrange(15, 240)
+            writer.writerow(['Cliente %d' % rng.randrange(20), date(2019, 1, 1) + timedelta(days=i * 365 // count),
+                             '%02d:%02d' % divmod(start, 60), '%02d:%02d' % divmod(end, 60), rng.choice(types)])
+
+
+def runWorkload(name, workdir):
+    """Build one workload in this process and return its measurements."""
+    from createportfolio import BasicPortfolio
+    from imageprep import ImageCache
+    from pdf_timesheet import PDFPSReporte
+    from sessionsource import CSVSessionSource
+
+    kind, size = workloads[name]
+    output = os.path.join(workdir, name + '.pdf')
+    started, cpuStarted = time.perf_counter(), time.process_time()
+    if kind == 'timesheet':
+        report = PDFPSReporte(output, sessions=CSVSessionSource(os.path.join(workdir, name + '.csv')))
+    else:
+        # A cold image cache, so every run transcodes the same photos
+        cache = ImageCache(os.path.join(workdir, name + '-images'))
+        report = BasicPortfolio(output, [photos[i % len(photos)] for i in range(size)], imageCache=cache)
+    seconds = time.perf_counter() - started
+    result = {
+        'seconds': round(seconds, 3),
+        'cpuSeconds': round(time.process_time() - cpuStarted, 3),
+        'bytes': os.path.getsize(output),
+        'pages': report.doc.page,
+        'pagesPerSecond': round(report.doc.page / seconds, 1),
+    }
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['peakRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return result
+
+
+def measure(name, workdir):
+    # A process per workload keeps peak RSS and caches separate
+    kind, size = workloads[name]
+    if kind == 'timesheet':
+        writeSessions(os.path.join(workdir, name + '.csv'), size)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-one', name, '--workdir', workdir],
+                         cwd=here, capture_output=True, text=True)
+    if out.returncode:
+        return {'error': out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'exit %d' % out.returncode}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    """Return (workload, metric, baseline, current, change) for every regression."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('workloads', {}).get(name)
+        if not before or 'error' in result or 'error' in before:
+            continue
+        for metric in compared:
+            if before.get(metric) and metric in result:
+                change = result[metric] / float(before[metric]) - 1
+                if change > threshold:
+                    regressions.append((name, metric, before[metric], result[metric], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark report generation on fixed workloads.')
+    parser.add_argument('--only', action='append',
+                        help="workload name, or a kind such as 'timesheet'; repeatable")
+    parser.add_argument('--output', default=os.path.join(here, 'benchmark-results.json'))
+    parser.add_argument('--baseline', default=os.path.join(here, 'benchmark-baseline.json'))
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown or growth flagged as a regression (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='also store the results as the baseline')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(runWorkload(args.run_one, args.workdir)))
+        return 0
+
+    names = [name for name in workloads
+             if not args.only or any(name == o or workloads[name][0] == o for o in args.only)]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='portfoliolio-bench-') as workdir:
+        for name in names:
+            result = results[name] = measure(name, workdir)
+            if 'error' in result:
+                print('%-16s FAILED %s' % (name, result['error']))
+            else:
+                print('%-16s %8.2fs %8.2fs cpu %6d pages %8.1f pages/s %10d bytes %6.0f MB rss' % (
+                    name, result['seconds'], result['cpuSeconds'], result['pages'], result['pagesPerSecond'],
+                    result['bytes'], result.get('peakRss', 0) / 1048576.0))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workloads': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    status = 1 if any('error' in r for r in results.values()) else 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, before, after, change in regressions:
+            print('REGRESSION %-16s %-10s %s -> %s (+%.0f%%)' % (name, metric, before, after, change * 100))
+        if regressions:
+            status = 1
+        else:
+            print('No regressions above %.0f%% against %s' % (args.threshold * 100, args.baseline))
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('Baseline saved to %s' % args.baseline)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import json
+import os
+import sysconfig
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Phases reported to progress callbacks
+STORY = 'story'
+IMAGES = 'images'
+LAYOUT = 'layout'
+SAVE = 'save'
+# Only timed, see BuildTrace: placing images on pages and drawing the
+# header and footer, both of which happen during layout
+EMBED = 'embed'
+FOOTER = 'footer'
+
+
+class BuildCancelled(Exception):
+    """Raised inside a build once its CancelToken has been cancelled; no file is written."""
+
+
+class CancelToken:
+    """Flag a caller sets, from any thread, to stop a running build at its next check."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise BuildCancelled()
+
+
+class BuildTrace:
+    """Wall time spent in each build phase and counts of what was built.
+
+    Phases nest per thread: layout includes the embed, footer and save time
+    spent inside it, so each phase also keeps its own time without its
+    children. IMAGES runs on the photo worker threads, alongside the rest.
+    writeTrace saves every phase as a Chrome trace event, for
+    chrome://tracing or https://ui.perfetto.dev.
+
+    With memory=True tracemalloc runs until stop(), and each phase on the
+    thread that made the trace also records the peak traced memory while
+    it ran. tracemalloc is process-wide, so photos prepared on worker
+    threads count towards whatever phase the build thread is in. Every
+    outermost phase is bracketed by snapshots, and the topSites lines
+    whose allocations grew the most across it are kept.
+    """
+
+    def __init__(self, memory=False, topSites=10):
+        self.started = time.perf_counter()
+        self.events = []
+        # phase -> [calls, seconds, own seconds, peak bytes]
+        self.phases = {}
+        # 'flowables', 'pages', 'images', 'bytes'
+        self.counts = {}
+        # outermost phase -> {'file:line': [bytes, blocks]} still held at its end
+        self.allocations = {}
+        self.memory = memory
+        self.topSites = topSites
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = set()
+        self._memoryThread = threading.get_ident()
+        self._startedTracing = memory and not tracemalloc.is_tracing()
+        if self._startedTracing:
+            tracemalloc.start()
+
+    def stop(self):
+        # Leaves tracemalloc alone if something else started it
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+        self.memory = False
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        # [name, seconds spent in nested phases, peak bytes]
+        frame = [name, 0.0, 0]
+        measure = self.memory and threading.get_ident() == self._memoryThread
+        before = None
+        if measure:
+            # The parent's peak so far, then measure this phase on its own
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+            else:
+                before = self._snapshot()
+            tracemalloc.reset_peak()
+            frame[2] = current
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            stack.pop()
+            if stack:
+                stack[-1][1] += seconds
+            peak = None
+            if measure:
+                peak = frame[2] = max(frame[2], tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1][2] = max(stack[-1][2], peak)
+                else:
+                    self._allocated(name, before)
+                tracemalloc.reset_peak()
+            self._record(name, started, seconds, seconds - frame[1], peak)
+
+    def _snapshot(self):
+        # Without the trace's own events and modules imported on the way
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib.*>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+
+    def _allocated(self, name, before):
+        sites = self.allocations.setdefault(name, {})
+        for diff in self._snapshot().compare_to(before, 'lineno'):
+            if diff.size_diff > 0:
+                frame = diff.traceback[0]
+                site = sites.setdefault('%s:%d' % (_shortPath(frame.filename), frame.lineno), [0, 0])
+                site[0] += diff.size_diff
+                site[1] += diff.count_diff
+        top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:self.topSites]
+        self.allocations[name] = dict(top)
+
+    def _record(self, name, started, seconds, own, peak=None):
+        thread = threading.current_thread()
+        with self._lock:
+            total = self.phases.setdefault(name, [0, 0.0, 0.0, None])
+            total[0] += 1
+            total[1] += seconds
+            total[2] += own
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                                    'args': {'name': thread.name}})
+            event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                     'ts': round((started - self.started) * 1e6, 1), 'dur': round(seconds * 1e6, 1)}
+            if peak is not None:
+                total[3] = max(total[3] or 0, peak)
+                event['args'] = {'peakBytes': peak}
+            self.events.append(event)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def stats(self):
+        phases = {}
+        for name, (calls, seconds, own, peak) in self.phases.items():
+            phases[name] = {'calls': calls, 'seconds': round(seconds, 4), 'ownSeconds': round(own, 4)}
+            if peak is not None:
+                phases[name]['peakBytes'] = peak
+        stats = {'phases': phases, 'counts': dict(self.counts)}
+        if self.allocations:
+            stats['allocations'] = dict((name, [{'site': site, 'bytes': size, 'blocks': blocks}
+                                                for site, (size, blocks) in sites.items()])
+                                        for name, sites in self.allocations.items())
+        return stats
+
+    def summary(self):
+        return formatStats(self.stats())
+
+    def writeTrace(self, path):
+        with self._lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms', 'otherData': self.stats()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+
+
+def _shortPath(filename):
+    # reportlab/pdfbase/pdfdoc.py rather than the whole site-packages path
+    paths = sysconfig.get_paths()
+    for prefix in (paths['purelib'], paths['stdlib'], os.getcwd()):
+        if filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def formatStats(stats):
+    """BuildTrace.stats() as a table, e.g. from a batch.py job result."""
+    order = [STORY, IMAGES, LAYOUT, EMBED, FOOTER, SAVE]
+    phases = stats['phases']
+    lines = ['%-8s %7s %9s %9s %9s' % ('phase', 'calls', 'seconds', 'own', 'peak MB')]
+    for name in sorted(phases, key=lambda name: order.index(name) if name in order else len(order)):
+        phase = phases[name]
+        peak = '%9.1f' % (phase['peakBytes'] / 1048576.0) if 'peakBytes' in phase else '%9s' % '-'
+        lines.append('%-8s %7d %9.3f %9.3f %s' % (name, phase['calls'], phase['seconds'], phase['ownSeconds'],
+                                                 peak))
+    lines.append(', '.join('%s %d' % item for item in stats['counts'].items()))
+    for name, sites in stats.get('allocations', {}).items():
+        lines.append('Largest allocations still held after %s:' % name)
+        for site in sites:
+            lines.append('%9.1f KB %7d blocks  %s' % (site['bytes'] / 1024.0, site['blocks'], site['site']))
+    return '\n'.join(lines)
+
+
+class BuildMonitor:
+    """Passes a build's progress to its callback and checks its cancel token.
+
+    progress(phase, page, done, total) gets one of the phase names above;
+    page is None outside layout and save. IMAGES reports come from the
+    image worker threads. With a BuildTrace, phase() and count() feed it;
+    without one they cost next to nothing.
+    """
+
+    def __init__(self, progress=None, cancel=None, trace=None):
+        self.progress = progress
+        self.cancel = cancel
+        self.trace = trace
+
+    def phase(self, name):
+        if self.trace is None:
+            return nullcontext()
+        return self.trace.phase(name)
+
+    def count(self, name, n=1):
+        if self.trace is not None:
+            self.trace.count(name, n)
+
+    def check(self):
+        if self.cancel is not None:
+            self.cancel.check()
+
+    def report(self, phase, page, done, total):
+        self.check()
+        if self.progress is not None:
+            self.progress(phase, page, done, total)
@@ -1,50 +1,53 @@
-from reportlab.pdfgen import canvas
-from reportlab.platypus import (SimpleDocTemplate, Paragraph, PageBreak, Image, Spacer, Table, TableStyle)
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from reportlab.platypus import (Paragraph, PageBreak, Spacer, Table, TableStyle)
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.pagesizes import LETTER, inch
 from reportlab.graphics.shapes import Line, LineShape, Drawing
 from reportlab.lib.colors import Color
 
-class FooterCanvas(canvas.Canvas):
-
-    def __init__(self, *args, **kwargs):
-        canvas.Canvas.__init__(self, *args, **kwargs)
-        self.pages = []
-        self.width, self.height = LETTER
-
-    def showPage(self):
-        self.pages.append(dict(self.__dict__))
-        self._startPage()
-
-    def save(self):
-        page_count = len(self.pages)
-        for page in self.pages:
-            self.__dict__.update(page)
-            if (self._pageNumber > 1):
-                self.draw_canvas(page_count)
-            canvas.Canvas.showPage(self)
-        canvas.Canvas.save(self)
-
-    def draw_canvas(self, page_count):
-        page = "Page %s of %s" % (self._pageNumber, page_count)
-        x = 128
-        self.saveState()
-        self.setStrokeColorRGB(0, 0, 0)
-        self.setLineWidth(0.5)
-        self.drawImage("static/lr.png", self.width-inch*8-5, self.height-50, width=100, height=20, preserveAspectRatio=True)
-        self.drawImage("static/ohka.png", self.width - inch * 2, self.height-50, width=100, height=30, preserveAspectRatio=True, mask='auto')
-        self.line(30, 740, LETTER[0] - 50, 740)
-        self.line(66, 78, LETTER[0] - 66, 78)
-        self.setFont('Times-Roman', 10)
-        self.drawString(LETTER[0]-x, 65, page)
-        self.restoreState()
+from buildcontrol import IMAGES, LAYOUT, STORY, BuildMonitor
+from imageprep import defaultImageCache, displaySize, passthroughSlack, preparePhoto, probeImage
+from reportcanvas import (CachedImage, CachedPage, FooterCanvas, LazyStory, Photo, PhotoStream, ProgressDocTemplate,
+                          SegmentStart)
+
 
 class BasicPortfolio:
 
-    def __init__(self, path, photos):
+    # Largest box a photo is drawn in, in points. The width is what the
+    # page takes with half-inch margins, wider than the frame, as photos
+    # have always been drawn; the height is further limited to what is
+    # left under the header, see photoRoom.
+    maxPhotoSize = (7.5 * inch, 8 * inch)
+    # Space above each photo
+    photoTopSpace = 100
+    # Photos handed to the pool before layout reaches them
+    photosAhead = 16
+
+    def __init__(self, path, photos, photoDpi=150, photoQuality=85, imageCache=None, workers=None,
+                 progress=None, cancel=None, pageCache=None, trace=None, passthroughSlack=passthroughSlack):
         self.path = path
+        # progress(phase, page, done, total), an optional CancelToken and
+        # an optional BuildTrace, see buildcontrol.BuildMonitor
+        self.monitor = BuildMonitor(progress, cancel, trace)
+        self.photoDpi = photoDpi
+        self.photoQuality = photoQuality
+        # Originals up to this many times the pixels needed are embedded
+        # as-is, see imageprep.passthroughSlack
+        self.passthroughSlack = passthroughSlack
+        self.imageCache = imageCache if imageCache is not None else defaultImageCache()
+        # photo path -> 'passthrough', 'cached' or 'transcoded'
+        self.imageReport = {}
+        # Pass the same reportcanvas.PageCache to successive builds and only
+        # photos that were added, moved to or from the front, or changed on
+        # disk are laid out again; other pages are replayed from the cache.
+        self.pageCache = pageCache
+        self.pagesReused = 0
         self.styleSheet = getSampleStyleSheet()
+        # Flowables made since the story last handed them to layout
         self.elements = []
 
         # colors - Azul turkeza 367AB3
@@ -55,17 +58,43 @@ class BasicPortfolio:
         self.colorOhkaBlue0 = Color((54.0/255), (122.0/255), (179.0/255), 1)
         self.colorOhkaBlue1 = Color((122.0/255), (180.0/255), (225.0/255), 1)
         self.colorOhkaGreenLineas = Color((50.0/255), (140.0/255), (140.0/255), 1)
-        #
-        for i in photos:
-            self.photopage(i)
-            self.nextPagesHeader(True)
-
-        # Build
-        self.doc = SimpleDocTemplate(path, pagesize=LETTER)
-        self.doc.multiBuild(self.elements, canvasmaker=FooterCanvas)
+        # Photos are prepared in the background, photosAhead of the page
+        # being laid out; each Photo only waits for its own result when
+        # drawn. workers=None lets the pool size itself from the CPU count.
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.photoJobs = {}
+        self._photoRoom = None
+        self.photosTotal = len(set(photos))
+        self.photosDone = 0
+        self._photosLock = threading.Lock()
+        try:
+            # Build; about 11 flowables per photo, fewer for replayed pages
+            self.doc = ProgressDocTemplate(path, monitor=self.monitor, pagesize=LETTER)
+            with self.monitor.phase(LAYOUT):
+                self.doc.build(LazyStory(self.story(photos), estimate=11 * len(photos)),
+                               canvasmaker=FooterCanvas)
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    def story(self, photos):
+        # One photo segment at a time, made as layout gets to it
+        for done, i in enumerate(photos):
+            self.monitor.report(STORY, None, done, len(photos))
+            self.photoSegment(i, done > 0)
+            for photourl in photos[done + 1:done + 1 + self.photosAhead]:
+                self.photoJob(photourl)
+            yield from self.takeElements()
+        if self.pageCache is not None:
+            self.elements.append(SegmentStart())
+        self.nextPagesHeader(True)
+        yield from self.takeElements()
+
+    def takeElements(self):
+        elements, self.elements = self.elements, []
+        return elements
 
     def firstPage(self):
-        img = Image('static/lr.png', kind='proportional')
+        img = CachedImage('static/lr.png', kind='proportional')
         img.drawHeight = 0.5*inch
         img.drawWidth = 2.4*inch
         img.hAlign = 'LEFT'
@@ -74,7 +103,7 @@ class BasicPortfolio:
         spacer = Spacer(30, 100)
         self.elements.append(spacer)
 
-        img = Image('static/ohka.png')
+        img = CachedImage('static/ohka.png')
         img.drawHeight = 2.5*inch
         img.drawWidth = 5.5*inch
         self.elements.append(img)
@@ -92,13 +121,48 @@ class BasicPortfolio:
         self.elements.append(paragraphReportSummary)
         self.elements.append(PageBreak())
 
+    def photoSegment(self, photourl, withHeader):
+        # One photo's pages: the previous page's header, then its photopage.
+        # Each segment starts on a fresh page, so its layout depends on
+        # nothing but the photo and the build settings.
+        if self.pageCache is None:
+            if withHeader:
+                self.nextPagesHeader(True)
+            self.photopage(photourl)
+            return
+
+        width, height, photo = self.photoJob(photourl)
+        st = os.stat(photourl)
+        key = (os.path.abspath(photourl), st.st_mtime_ns, st.st_size, width, height,
+               self.photoDpi, self.photoQuality, withHeader)
+        pages = self.pageCache.get(key)
+        if pages is not None:
+            for page in pages:
+                self.elements.append(CachedPage(page, photo))
+                self.elements.append(PageBreak())
+            self.pagesReused += len(pages)
+            return
+        self.elements.append(SegmentStart(key, self.pageCache))
+        if withHeader:
+            self.nextPagesHeader(True)
+        self.photopage(photourl)
+
+    def photoJob(self, photourl):
+        # The same file dropped several times is only prepared once. Its
+        # bytes are let go once embedded, later pages reuse the XObject.
+        job = self.photoJobs.get(photourl)
+        if job is None:
+            width, height = self.photoSize(photourl)
+            future = self.pool.submit(self.loadPhoto, photourl, width, height)
+            job = self.photoJobs[photourl] = (width, height, PhotoStream(future.result))
+        return job
+
     def photopage(self, photourl):
-        spacer = Spacer(30, 100)
+        spacer = Spacer(30, self.photoTopSpace)
         self.elements.append(spacer)
 
-        img = Image(photourl)
-        img.drawHeight = 2.5*inch
-        img.drawWidth = 5.5*inch
+        width, height, photo = self.photoJob(photourl)
+        img = Photo(photo, width, height)
         self.elements.append(img)
 
         spacer = Spacer(10, 250)
@@ -114,6 +178,42 @@ class BasicPortfolio:
         self.elements.append(paragraphReportSummary)
         self.elements.append(PageBreak())
 
+    def loadPhoto(self, photourl, width, height):
+        # Runs on the pool; a cancelled build stops picking up new photos
+        self.monitor.check()
+        with self.monitor.phase(IMAGES):
+            data, how = preparePhoto(photourl, width, height, self.photoDpi, self.photoQuality,
+                                     cache=self.imageCache, slack=self.passthroughSlack)
+        self.imageReport[photourl] = how
+        with self._photosLock:
+            self.photosDone += 1
+            done = self.photosDone
+        self.monitor.report(IMAGES, None, done, self.photosTotal)
+        return data
+
+    def photoSize(self, photourl):
+        # Drawn upright at a third of its pixel size, shrunk to fit maxPhotoSize
+        width, height = displaySize(probeImage(photourl))
+        width, height = width / 3, height / 3
+        factor = min(1.0, self.maxPhotoSize[0] / width, min(self.maxPhotoSize[1], self.photoRoom()) / height)
+        return width * factor, height * factor
+
+    def photoRoom(self):
+        # Frame height left under the section header and the top spacer, so a
+        # photo always shares its page with the header above it
+        if self._photoRoom is None:
+            elements, self.elements = self.elements, []
+            self.nextPagesHeader(True)
+            header = self.takeElements()
+            self.elements = elements
+            # Less the frame's default 6pt padding top and bottom, and a
+            # point for rounding
+            height = self.doc.height - 12
+            used = sum(f.wrap(self.doc.width - 12, height)[1] + f.getSpaceBefore() + f.getSpaceAfter()
+                       for f in header)
+            self._photoRoom = height - used - self.photoTopSpace - 1
+        return self._photoRoom
+
     def nextPagesHeader(self, isSecondPage):
         if isSecondPage:
             psHeaderText = ParagraphStyle('Hed0', fontSize=16, alignment=TA_LEFT, borderWidth=3, textColor=self.colorOhkaGreen0)
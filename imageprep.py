@@ -0,0 +1,295 @@
+import hashlib
+import io
+import os
+import struct
+import threading
+
+from PIL import Image as PILImage, ImageOps
+
+defaultCacheDir = os.path.join(os.path.expanduser('~'), '.portfoliolio', 'images')
+defaultThumbnailDir = os.path.join(os.path.expanduser('~'), '.portfoliolio', 'thumbs')
+# How far above the target resolution an original JPEG may be and still be
+# embedded as-is. By default only originals that already fit the target
+# are; raising it is an opt-in that trades output size for build time.
+passthroughSlack = 1.0
+# Bump when encodePhoto output changes so stale cache entries are not reused
+cacheVersion = 2
+
+_pngSignature = b'\x89PNG\r\n\x1a\n'
+# SOFn markers, i.e. 0xC0-0xCF minus DHT, JPG and DAC
+_jpegSOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImageCache:
+    """On-disk cache of ready-to-embed photo streams.
+
+    Entries are keyed on the source file's content hash plus the target
+    size, quality and colorspace. Once the directory grows past maxBytes
+    the least recently used are evicted until it is down to lowWater of
+    that, so the directory is only rescanned every so many inserts.
+    """
+
+    lowWater = 0.8
+
+    def __init__(self, directory=defaultCacheDir, maxBytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Photos are prepared from a thread pool, see BasicPortfolio
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, path, size, quality, colorspace):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(('%sx%s-q%s-%s-v%s' % (size[0], size[1], quality, colorspace, cacheVersion)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # mtime doubles as the last-used time for eviction
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass  # evicted by another thread since we read it
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        entry = os.path.join(self.directory, key)
+        tmp = '%s.%s.%s.tmp' % (entry, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(entry)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, entry)
+            self._size += len(data)
+            if self._size > self.maxBytes:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum(size for _, size, _ in entries)
+        target = self.maxBytes * self.lowWater
+        for entry, size, _ in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bytes': self._size}
+
+    def _entries(self):
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith('.tmp'):
+                    st = e.stat()
+                    yield e.path, st.st_size, st.st_mtime
+
+
+_defaultCache = None
+
+
+def defaultImageCache():
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = ImageCache()
+    return _defaultCache
+
+
+def probeImage(path):
+    """Return (format, width, height, orientation) read from the file header only.
+
+    width and height are the stored pixel size; orientation is the EXIF
+    orientation tag (1 when absent), see displaySize.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(24)
+        if head[:8] == _pngSignature and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return 'PNG', width, height, 1
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            info = _probeJPEG(f)
+            if info:
+                return info
+    # Anything else goes through PIL, which also stops at the header
+    with PILImage.open(path) as im:
+        return im.format, im.width, im.height, im.getexif().get(0x0112, 1)
+
+
+def displaySize(info):
+    # Orientations 5-8 are rotated a quarter turn
+    format, width, height, orientation = info
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def _probeJPEG(f):
+    # None when the header cannot be read, probeImage then asks PIL
+    try:
+        return _readJPEGHeader(f)
+    except struct.error:
+        return None  # truncated or malformed
+
+
+def _readJPEGHeader(f):
+    orientation = 1
+    while True:
+        b = f.read(1)
+        while b and b != b'\xff':
+            b = f.read(1)
+        while b == b'\xff':
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue  # standalone markers carry no length
+        if marker == 0xD9:
+            return None
+        length = struct.unpack('>H', f.read(2))[0]
+        if length < 2:
+            return None
+        if marker in _jpegSOF:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return 'JPEG', width, height, orientation
+        if marker == 0xE1:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                orientation = _exifOrientation(segment[6:])
+        else:
+            f.seek(length - 2, 1)
+
+
+def _exifOrientation(tiff):
+    try:
+        endian = '<' if tiff[:2] == b'II' else '>'
+        ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+        for i in range(count):
+            entry = ifd + 2 + 12 * i
+            tag, type, n, value = struct.unpack(endian + 'HHIH', tiff[entry:entry + 10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        pass
+    return 1
+
+
+def targetPixels(drawWidth, drawHeight, dpi):
+    # drawWidth/drawHeight are in points (1/72 inch)
+    return (max(1, int(round(drawWidth * dpi / 72.0))),
+            max(1, int(round(drawHeight * dpi / 72.0))))
+
+
+def encodePhoto(path, size, quality=85, colorspace=None):
+    im = PILImage.open(path)
+    # Let the JPEG decoder do most of the reduction in the DCT domain.
+    # size is upright, the stored pixels may still need a quarter turn.
+    rotated = im.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+    im.draft(colorspace or 'RGB', (size[1], size[0]) if rotated else size)
+    im = ImageOps.exif_transpose(im)
+    if colorspace and im.mode != colorspace:
+        im = im.convert(colorspace)
+    elif im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    # Never upsample, a small photo is embedded at its own resolution
+    if size[0] < im.width and size[1] < im.height:
+        im = im.resize(size, PILImage.LANCZOS)
+
+    buf = io.BytesIO()
+    im.save(buf, 'JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def canPassThrough(im, size, colorspace=None, slack=passthroughSlack):
+    # PDF viewers ignore EXIF, so only upright originals can be copied as-is
+    return (im.format == 'JPEG' and im.mode in ('RGB', 'L')
+            and (colorspace is None or im.mode == colorspace)
+            and im.getexif().get(0x0112, 1) == 1
+            and im.width <= size[0] * slack and im.height <= size[1] * slack)
+
+
+def preparePhoto(path, drawWidth, drawHeight, dpi=150, quality=85, colorspace=None, cache=None,
+                 slack=passthroughSlack):
+    """Return (data, how) with the JPEG stream to embed for the photo at path.
+
+    how is 'passthrough' when the original file is used as-is (at most slack
+    times the target pixel size), 'cached' when a previously transcoded copy
+    was found in cache and 'transcoded' otherwise.
+    """
+    size = targetPixels(drawWidth, drawHeight, dpi)
+    # Opening only parses the header, pixels are not decoded here
+    with PILImage.open(path) as im:
+        passthrough = canPassThrough(im, size, colorspace, slack)
+    if passthrough:
+        with open(path, 'rb') as f:
+            return f.read(), 'passthrough'
+
+    if cache is None:
+        return encodePhoto(path, size, quality, colorspace), 'transcoded'
+
+    key = cache.key(path, size, quality, colorspace)
+    data = cache.get(key)
+    if data is not None:
+        return data, 'cached'
+    data = encodePhoto(path, size, quality, colorspace)
+    cache.put(key, data)
+    return data, 'transcoded'
+
+
+def thumbnailKey(path, size):
+    # Keyed on where the file is and when it changed, so no content is read
+    st = os.stat(path)
+    key = '%s|%s|%s|%s' % (os.path.abspath(path), st.st_mtime_ns, st.st_size, size)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def makeThumbnail(path, size=48):
+    im = PILImage.open(path)
+    # JPEGs decode straight at 1/2 to 1/8 scale, close to the thumbnail size
+    im.draft('RGB', (size, size))
+    im = ImageOps.exif_transpose(im)
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    im.thumbnail((size, size))
+
+    buf = io.BytesIO()
+    im.save(buf, 'JPEG', quality=80)
+    return buf.getvalue()
+
+
+def cachedThumbnail(path, size, cache):
+    key = thumbnailKey(path, size)
+    data = cache.get(key)
+    if data is None:
+        data = makeThumbnail(path, size)
+        cache.put(key, data)
+    return data
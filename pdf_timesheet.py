@@ -1,50 +1,37 @@
-from reportlab.pdfgen import canvas
-from reportlab.platypus import (SimpleDocTemplate, Paragraph, PageBreak, Image, Spacer, Table, TableStyle)
+import sys
+from datetime import date
+from xml.sax.saxutils import escape
+
+from reportlab.platypus import (Paragraph, PageBreak, Spacer, Table, TableStyle)
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.pagesizes import LETTER, inch
 from reportlab.graphics.shapes import Line, LineShape, Drawing
 from reportlab.lib.colors import Color
 
-class FooterCanvas(canvas.Canvas):
-
-    def __init__(self, *args, **kwargs):
-        canvas.Canvas.__init__(self, *args, **kwargs)
-        self.pages = []
-        self.width, self.height = LETTER
-
-    def showPage(self):
-        self.pages.append(dict(self.__dict__))
-        self._startPage()
-
-    def save(self):
-        page_count = len(self.pages)
-        for page in self.pages:
-            self.__dict__.update(page)
-            if (self._pageNumber > 1):
-                self.draw_canvas(page_count)
-            canvas.Canvas.showPage(self)
-        canvas.Canvas.save(self)
-
-    def draw_canvas(self, page_count):
-        page = "Page %s of %s" % (self._pageNumber, page_count)
-        x = 128
-        self.saveState()
-        self.setStrokeColorRGB(0, 0, 0)
-        self.setLineWidth(0.5)
-        self.drawImage("static/lr.png", self.width-inch*8-5, self.height-50, width=100, height=20, preserveAspectRatio=True)
-        self.drawImage("static/ohka.png", self.width - inch * 2, self.height-50, width=100, height=30, preserveAspectRatio=True, mask='auto')
-        self.line(30, 740, LETTER[0] - 50, 740)
-        self.line(66, 78, LETTER[0] - 66, 78)
-        self.setFont('Times-Roman', 10)
-        self.drawString(LETTER[0]-x, 65, page)
-        self.restoreState()
+from buildcontrol import LAYOUT, STORY, BuildMonitor
+from reportcanvas import CachedImage, FooterCanvas, LazyStory, ProgressDocTemplate, StreamingTable
+from sessionsource import (ONSITE, OTHER, REMOTE, SampleSessionSource, formatHours, formatLongDate, formatShortDate,
+                           openSessionSource, sessionRows, sessionTotals)
 
 class PDFPSReporte:
 
-    def __init__(self, path):
+    sessionColumns = ["No.", "Fecha", "Hora Inicio", "Hora Fin", "Tiempo Total"]
+    sessionColWidths = [50, 200, 80, 80, 80]
+
+    def __init__(self, path, progress=None, cancel=None, sessions=None, contractedHours=120, trace=None):
         self.path = path
+        # A sessionsource.CSVSessionSource or SQLiteSessionSource; rows are
+        # pulled from it while the tables are laid out. Without one the
+        # tables show sample rows. contractedHours is what the summary
+        # subtracts consumed hours from.
+        self.sessions = sessions if sessions is not None else SampleSessionSource()
+        self.contractedMinutes = contractedHours * 60
+        # progress(phase, page, done, total), an optional CancelToken and
+        # an optional BuildTrace, see buildcontrol.BuildMonitor
+        self.monitor = BuildMonitor(progress, cancel, trace)
         self.styleSheet = getSampleStyleSheet()
+        # Flowables made since the story last handed them to layout
         self.elements = []
 
         # colors - Azul turkeza 367AB3
@@ -56,21 +43,37 @@ class PDFPSReporte:
         self.colorOhkaBlue1 = Color((122.0/255), (180.0/255), (225.0/255), 1)
         self.colorOhkaGreenLineas = Color((50.0/255), (140.0/255), (140.0/255), 1)
 
+        sections = [self.remoteSessionTableMaker,
+                    self.inSiteSessionTableMaker,
+                    self.extraActivitiesTableMaker,
+                    self.summaryTableMaker]
+        self.monitor.report(STORY, None, 0, len(sections))
+        with self.monitor.phase(STORY):
+            # Every totals row comes from this one pass over the sessions
+            self.totals = sessionTotals(self.sessions.allSessions())
+        # Build
+        self.doc = ProgressDocTemplate(path, monitor=self.monitor, pagesize=LETTER)
+        with self.monitor.phase(LAYOUT):
+            self.doc.build(LazyStory(self.story(sections)), canvasmaker=FooterCanvas)
+
+    def story(self, sections):
+        # A section at a time, made as layout gets to it
         self.firstPage()
         self.nextPagesHeader(True)
-        self.remoteSessionTableMaker()
-        self.nextPagesHeader(False)
-        self.inSiteSessionTableMaker()
-        self.nextPagesHeader(False)
-        self.extraActivitiesTableMaker()
-        self.nextPagesHeader(False)
-        self.summaryTableMaker()
-        # Build
-        self.doc = SimpleDocTemplate(path, pagesize=LETTER)
-        self.doc.multiBuild(self.elements, canvasmaker=FooterCanvas)
+        yield from self.takeElements()
+        for done, section in enumerate(sections, 1):
+            if done > 1:
+                self.nextPagesHeader(False)
+            section()
+            self.monitor.report(STORY, None, done, len(sections))
+            yield from self.takeElements()
+
+    def takeElements(self):
+        elements, self.elements = self.elements, []
+        return elements
 
     def firstPage(self):
-        img = Image('static/lr.png', kind='proportional')
+        img = CachedImage('static/lr.png', kind='proportional')
         img.drawHeight = 0.5*inch
         img.drawWidth = 2.4*inch
         img.hAlign = 'LEFT'
@@ -79,7 +82,7 @@ class PDFPSReporte:
         spacer = Spacer(30, 100)
         self.elements.append(spacer)
 
-        img = Image('static/ohka.png')
+        img = CachedImage('static/ohka.png')
         img.drawHeight = 2.5*inch
         img.drawWidth = 5.5*inch
         self.elements.append(img)
@@ -88,11 +91,15 @@ class PDFPSReporte:
         self.elements.append(spacer)
 
         psDetalle = ParagraphStyle('Resumen', fontSize=9, leading=14, justifyBreaks=1, alignment=TA_LEFT, justifyLastLine=1)
+        # Whatever the session source was narrowed down to
+        client = getattr(self.sessions, 'client', None) or 'Todos los clientes'
+        since = getattr(self.sessions, 'since', None)
+        until = getattr(self.sessions, 'until', None) or date.today()
         text = """REPORTE DE SERVICIOS PROFESIONALES<br/>
-        Empresa: Nombre del Cliente<br/>
-        Fecha de Inicio: 23-Oct-2019<br/>
-        Fecha de actualización: 01-Abril-2020<br/>
-        """
+        Empresa: %s<br/>
+        Fecha de Inicio: %s<br/>
+        Fecha de actualización: %s<br/>
+        """ % (escape(client), formatShortDate(since) if since else '-', formatLongDate(until))
         paragraphReportSummary = Paragraph(text, psDetalle)
         self.elements.append(paragraphReportSummary)
         self.elements.append(PageBreak())
@@ -127,7 +134,7 @@ class PDFPSReporte:
             spacer = Spacer(10, 22)
             self.elements.append(spacer)
 
-    def remoteSessionTableMaker(self):        
+    def remoteSessionTableMaker(self):
         psHeaderText = ParagraphStyle('Hed0', fontSize=12, alignment=TA_LEFT, borderWidth=3, textColor=self.colorOhkaBlue0)
         text = 'SESIONES REMOTAS'
         paragraphReportHeader = Paragraph(text, psHeaderText)
@@ -135,63 +142,7 @@ class PDFPSReporte:
 
         spacer = Spacer(10, 22)
         self.elements.append(spacer)
-        """
-        Create the line items
-        """
-        d = []
-        textData = ["No.", "Fecha", "Hora Inicio", "Hora Fin", "Tiempo Total"]
-                
-        fontSize = 8
-        centered = ParagraphStyle(name="centered", alignment=TA_CENTER)
-        for text in textData:
-            ptext = "<font size='%s'><b>%s</b></font>" % (fontSize, text)
-            titlesTable = Paragraph(ptext, centered)
-            d.append(titlesTable)        
-
-        data = [d]
-        lineNum = 1
-        formattedLineData = []
-
-        alignStyle = [ParagraphStyle(name="01", alignment=TA_CENTER),
-                      ParagraphStyle(name="02", alignment=TA_LEFT),
-                      ParagraphStyle(name="03", alignment=TA_CENTER),
-                      ParagraphStyle(name="04", alignment=TA_CENTER),
-                      ParagraphStyle(name="05", alignment=TA_CENTER)]
-
-        for row in range(10):
-            lineData = [str(lineNum), "Miércoles, 11 de diciembre de 2019", 
-                                            "17:30", "19:24", "1:54"]
-            #data.append(lineData)
-            columnNumber = 0
-            for item in lineData:
-                ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-                p = Paragraph(ptext, alignStyle[columnNumber])
-                formattedLineData.append(p)
-                columnNumber = columnNumber + 1
-            data.append(formattedLineData)
-            formattedLineData = []
-            
-        # Row for total
-        totalRow = ["Total de Horas", "", "", "", "30:15"]
-        for item in totalRow:
-            ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-            p = Paragraph(ptext, alignStyle[1])
-            formattedLineData.append(p)
-        data.append(formattedLineData)
-        
-        #print(data)
-        table = Table(data, colWidths=[50, 200, 80, 80, 80])
-        tStyle = TableStyle([ #('GRID',(0, 0), (-1, -1), 0.5, grey),
-                ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-                #('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ("ALIGN", (1, 0), (1, -1), 'RIGHT'),
-                ('LINEABOVE', (0, 0), (-1, -1), 1, self.colorOhkaBlue1),
-                ('BACKGROUND',(0, 0), (-1, 0), self.colorOhkaGreenLineas),
-                ('BACKGROUND',(0, -1),(-1, -1), self.colorOhkaBlue1),
-                ('SPAN',(0,-1),(-2,-1))
-                ])
-        table.setStyle(tStyle)
-        self.elements.append(table)
+        self.elements.append(self.sessionTable(self.sectionRows(REMOTE), self.sectionTotal(REMOTE)))
 
     def inSiteSessionTableMaker(self):
         self.elements.append(PageBreak())
@@ -202,63 +153,7 @@ class PDFPSReporte:
 
         spacer = Spacer(10, 22)
         self.elements.append(spacer)
-        """
-        Create the line items
-        """
-        d = []
-        textData = ["No.", "Fecha", "Hora Inicio", "Hora Fin", "Tiempo Total"]
-                
-        fontSize = 8
-        centered = ParagraphStyle(name="centered", alignment=TA_CENTER)
-        for text in textData:
-            ptext = "<font size='%s'><b>%s</b></font>" % (fontSize, text)
-            titlesTable = Paragraph(ptext, centered)
-            d.append(titlesTable)        
-
-        data = [d]
-        lineNum = 1
-        formattedLineData = []
-
-        alignStyle = [ParagraphStyle(name="01", alignment=TA_CENTER),
-                      ParagraphStyle(name="02", alignment=TA_LEFT),
-                      ParagraphStyle(name="03", alignment=TA_CENTER),
-                      ParagraphStyle(name="04", alignment=TA_CENTER),
-                      ParagraphStyle(name="05", alignment=TA_CENTER)]
-
-        for row in range(10):
-            lineData = [str(lineNum), "Miércoles, 11 de diciembre de 2019", 
-                                            "17:30", "19:24", "1:54"]
-            #data.append(lineData)
-            columnNumber = 0
-            for item in lineData:
-                ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-                p = Paragraph(ptext, alignStyle[columnNumber])
-                formattedLineData.append(p)
-                columnNumber = columnNumber + 1
-            data.append(formattedLineData)
-            formattedLineData = []
-            
-        # Row for total
-        totalRow = ["Total de Horas", "", "", "", "30:15"]
-        for item in totalRow:
-            ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-            p = Paragraph(ptext, alignStyle[1])
-            formattedLineData.append(p)
-        data.append(formattedLineData)
-        
-        #print(data)
-        table = Table(data, colWidths=[50, 200, 80, 80, 80])
-        tStyle = TableStyle([ #('GRID',(0, 0), (-1, -1), 0.5, grey),
-                ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-                #('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ("ALIGN", (1, 0), (1, -1), 'RIGHT'),
-                ('LINEABOVE', (0, 0), (-1, -1), 1, self.colorOhkaBlue1),
-                ('BACKGROUND',(0, 0), (-1, 0), self.colorOhkaGreenLineas),
-                ('BACKGROUND',(0, -1),(-1, -1), self.colorOhkaBlue1),
-                ('SPAN',(0,-1),(-2,-1))
-                ])
-        table.setStyle(tStyle)
-        self.elements.append(table)
+        self.elements.append(self.sessionTable(self.sectionRows(ONSITE), self.sectionTotal(ONSITE)))
 
     def extraActivitiesTableMaker(self):
         self.elements.append(PageBreak())
@@ -269,63 +164,41 @@ class PDFPSReporte:
 
         spacer = Spacer(10, 22)
         self.elements.append(spacer)
+        self.elements.append(self.sessionTable(self.sectionRows(OTHER), self.sectionTotal(OTHER)))
+
+    def sectionRows(self, section):
+        return sessionRows(self.sessions.sessions(section))
+
+    def sectionTotal(self, section):
+        return formatHours(self.totals.bySection[section])
+
+    def sessionTable(self, rows, total):
         """
-        Create the line items
+        Session table with a header row, one row per item of rows and a
+        "Total de Horas" row.
+
+        Cells are plain strings; fonts and alignment come from the
+        TableStyle below, so no cell goes through the paragraph parser and
+        every row is one leading high. Cells do not wrap. rows may be any
+        iterable, it is only pulled a page at a time and the header is
+        repeated on every page.
         """
-        d = []
-        textData = ["No.", "Fecha", "Hora Inicio", "Hora Fin", "Tiempo Total"]
-                
-        fontSize = 8
-        centered = ParagraphStyle(name="centered", alignment=TA_CENTER)
-        for text in textData:
-            ptext = "<font size='%s'><b>%s</b></font>" % (fontSize, text)
-            titlesTable = Paragraph(ptext, centered)
-            d.append(titlesTable)        
-
-        data = [d]
-        lineNum = 1
-        formattedLineData = []
-
-        alignStyle = [ParagraphStyle(name="01", alignment=TA_CENTER),
-                      ParagraphStyle(name="02", alignment=TA_LEFT),
-                      ParagraphStyle(name="03", alignment=TA_CENTER),
-                      ParagraphStyle(name="04", alignment=TA_CENTER),
-                      ParagraphStyle(name="05", alignment=TA_CENTER)]
-
-        for row in range(10):
-            lineData = [str(lineNum), "Miércoles, 11 de diciembre de 2019", 
-                                            "17:30", "19:24", "1:54"]
-            #data.append(lineData)
-            columnNumber = 0
-            for item in lineData:
-                ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-                p = Paragraph(ptext, alignStyle[columnNumber])
-                formattedLineData.append(p)
-                columnNumber = columnNumber + 1
-            data.append(formattedLineData)
-            formattedLineData = []
-            
-        # Row for total
-        totalRow = ["Total de Horas", "", "", "", "30:15"]
-        for item in totalRow:
-            ptext = "<font size='%s'>%s</font>" % (fontSize-1, item)
-            p = Paragraph(ptext, alignStyle[1])
-            formattedLineData.append(p)
-        data.append(formattedLineData)
-        
-        #print(data)
-        table = Table(data, colWidths=[50, 200, 80, 80, 80])
-        tStyle = TableStyle([ #('GRID',(0, 0), (-1, -1), 0.5, grey),
-                ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-                #('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ("ALIGN", (1, 0), (1, -1), 'RIGHT'),
+        style = [ #('GRID',(0, 0), (-1, -1), 0.5, grey),
+                ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 8, 12),
+                ('FONT', (0, 1), (-1, -1), 'Helvetica', 7, 12),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
                 ('LINEABOVE', (0, 0), (-1, -1), 1, self.colorOhkaBlue1),
                 ('BACKGROUND',(0, 0), (-1, 0), self.colorOhkaGreenLineas),
+                ]
+        totalStyle = [
+                ('ALIGN', (0, -1), (-1, -1), 'LEFT'),
                 ('BACKGROUND',(0, -1),(-1, -1), self.colorOhkaBlue1),
                 ('SPAN',(0,-1),(-2,-1))
-                ])
-        table.setStyle(tStyle)
-        self.elements.append(table)
+                ]
+        totalRow = ["Total de Horas", "", "", "", total]
+        return StreamingTable(self.sessionColumns, rows, totalRow, self.sessionColWidths, style, totalStyle)
 
     def summaryTableMaker(self):
         self.elements.append(PageBreak())
@@ -348,11 +221,10 @@ class PDFPSReporte:
                    ('BACKGROUND',(-2, -1),(-1, -1), self.colorOhkaGreen2)
                    ])
 
-        fontSize = 8
-        lineData = [["Sesiones remotas", "30:15"],
-                    ["Sesiones en sitio", "00:00"],
-                    ["Otras actividades", "00:00"],
-                    ["Total de horas consumidas", "30:15"]]
+        lineData = [["Sesiones remotas", self.sectionTotal(REMOTE)],
+                    ["Sesiones en sitio", self.sectionTotal(ONSITE)],
+                    ["Otras actividades", self.sectionTotal(OTHER)],
+                    ["Total de horas consumidas", formatHours(self.totals.consumed)]]
 
         # for row in lineData:
         #     for item in row:
@@ -370,8 +242,8 @@ class PDFPSReporte:
         data = []
         formattedLineData = []
 
-        lineData = [["Total de horas contratadas", "120:00"],
-                    ["Horas restantes por consumir", "00:00"]]
+        lineData = [["Total de horas contratadas", formatHours(self.contractedMinutes)],
+                    ["Horas restantes por consumir", formatHours(self.totals.remaining(self.contractedMinutes))]]
 
         # for row in lineData:
         #     for item in row:
@@ -396,4 +268,10 @@ class PDFPSReporte:
 
 
 if __name__ == '__main__':
-    report = PDFPSReporte('psreport2345.pdf')
+    # python pdf_timesheet.py [sessions.csv | sessions.db [client [since until]]]
+    sessions = None
+    if len(sys.argv) > 1:
+        client = sys.argv[2] if len(sys.argv) > 2 else None
+        since, until = (date.fromisoformat(d) for d in sys.argv[3:5]) if len(sys.argv) > 4 else (None, None)
+        sessions = openSessionSource(sys.argv[1], client, since, until)
+    report = PDFPSReporte('psreport2345.pdf', sessions=sessions)
@@ -3,7 +3,6 @@ from PyQt5.QtWidgets import QLabel, QPushButton
 from PyQt5.QtWidgets import QMainWindow
 from PyQt5.QtWidgets import QApplication
 import sys
-from reportlab.pdfgen import canvas
 from reportlab.platypus import (SimpleDocTemplate, Paragraph, PageBreak, Image, Spacer, Table, TableStyle)
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
@@ -12,6 +11,8 @@ from reportlab.graphics.shapes import Line, LineShape, Drawing
 from reportlab.lib.colors import Color
 from datetime import datetime
 
+from reportcanvas import FooterCanvas
+
 
 class Window(QMainWindow):
     def __init__(self):
@@ -65,43 +66,6 @@ class Window(QMainWindow):
         self.label.setText("\n".join(self.files))
 
 
-class FooterCanvas(canvas.Canvas):
-
-    def __init__(self, *args, **kwargs):
-        canvas.Canvas.__init__(self, *args, **kwargs)
-        self.pages = []
-        self.width, self.height = LETTER
-
-    def showPage(self):
-        self.pages.append(dict(self.__dict__))
-        self._startPage()
-
-    def save(self):
-        page_count = len(self.pages)
-        for page in self.pages:
-            self.__dict__.update(page)
-            if (self._pageNumber > 1):
-                self.draw_canvas(page_count)
-            canvas.Canvas.showPage(self)
-        canvas.Canvas.save(self)
-
-    def draw_canvas(self, page_count):
-        page = "Page %s of %s" % (self._pageNumber, page_count)
-        x = 128
-        self.saveState()
-        self.setStrokeColorRGB(0, 0, 0)
-        self.setLineWidth(0.5)
-        self.drawImage("static/lr.png", self.width - inch * 8 - 5, self.height - 50, width=100, height=20,
-                       preserveAspectRatio=True)
-        self.drawImage("static/ohka.png", self.width - inch * 2, self.height - 50, width=100, height=30,
-                       preserveAspectRatio=True, mask='auto')
-        self.line(30, 740, LETTER[0] - 50, 740)
-        self.line(66, 78, LETTER[0] - 66, 78)
-        self.setFont('Times-Roman', 10)
-        self.drawString(LETTER[0] - x, 65, page)
-        self.restoreState()
-
-
 class BasicPortfolio:
 
     def __init__(self, path, photos):
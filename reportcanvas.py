@@ -0,0 +1,530 @@
+import copy
+import hashlib
+import io
+import os
+import re
+from collections import OrderedDict
+
+from reportlab.lib.boxstuff import aspectRatioFix
+from reportlab.lib.pagesizes import LETTER, inch
+from reportlab.lib.utils import _digester
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, Image, SimpleDocTemplate, Table
+
+from buildcontrol import EMBED, FOOTER, LAYOUT, SAVE, STORY, BuildMonitor
+
+# Prepared image XObjects shared by every document this process writes,
+# keyed on (path, mask). Decoding, compression and the soft mask are done once.
+_imageCache = {}
+
+# Font selections in a page's content stream, e.g. "/F2 10 Tf"
+_fontSelection = re.compile(r'(/F\d+)( [-\d.]+ Tf)')
+# Operators that pull in page resources a recorded page cannot carry over
+_pageResources = re.compile(r' (gs|cs|CS|sh)$')
+
+
+def cachedImage(path, mask=None):
+    key = (path, str(mask))
+    imgObj = _imageCache.get(key)
+    if imgObj is None:
+        # Same name drawImage would give the file, so both paths share one object
+        name = _digester(('%s%s' % (path, mask)).encode('utf-8'))
+        imgObj = pdfdoc.PDFImageXObject(name, path, mask=mask)
+        _imageCache[key] = imgObj
+    return imgObj
+
+
+class CachedImage(Image):
+    """platypus Image whose XObject comes from the process-wide cache.
+
+    Needs a FooterCanvas, see FooterCanvas.drawCachedImage.
+    """
+
+    def draw(self):
+        self.canv.drawCachedImage(self.filename, getattr(self, '_offs_x', 0), getattr(self, '_offs_y', 0),
+                                  self.drawWidth, self.drawHeight, mask=self._mask)
+
+
+class PhotoStream:
+    """A photo's JPEG stream, embedded once per document and then used by name.
+
+    load is only called when the photo is first drawn, so layout never
+    waits on pixel work. The stream is named by its content hash; once the
+    document holds it, load is dropped and only the name is kept, so the
+    bytes are not held twice. Use one PhotoStream per document.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self.name = None
+
+    def register(self, canv):
+        """Add the stream to canv's document if it is not there yet; returns its name."""
+        if self.name is None:
+            data = self._load()
+            self.name = hashlib.sha1(data).hexdigest()
+            canv.registerPhoto(self.name, data)
+            self._load = None
+        return self.name
+
+
+class Photo(Flowable):
+    """PhotoStream drawn at a fixed size.
+
+    The same photo placed on several pages (or dropped twice) is embedded
+    once.
+    """
+
+    def __init__(self, photo, width, height, hAlign='CENTER'):
+        Flowable.__init__(self)
+        self.photo = photo
+        self.drawWidth = width
+        self.drawHeight = height
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        # Includes any wait for the photo to be prepared
+        with self.canv.monitor.phase(EMBED):
+            self.canv.drawPhoto(self.photo.register(self.canv), 0, 0, self.drawWidth, self.drawHeight)
+
+
+class StreamingTable(Flowable):
+    """Table fed from an iterator of rows and laid out a page at a time.
+
+    Every page gets a plain Table of the header plus as many rows as fit;
+    the total row, with totalStyle, goes under the last one. Rows must be
+    single-line so each is as high as the first one measured, which makes
+    every split O(rows on the page) and keeps only those rows in memory.
+    The iterator is consumed, so the table can only be built once.
+    """
+
+    def __init__(self, header, rows, total, colWidths, style=(), totalStyle=()):
+        Flowable.__init__(self)
+        self.header = header
+        self.rows = iter(rows)
+        self.total = total
+        self.colWidths = colWidths
+        self.style = list(style)
+        self.totalStyle = list(totalStyle)
+        self.hAlign = 'CENTER'
+        self._buffer = []
+        self._exhausted = False
+        self._heights = None
+
+    def _fill(self, n):
+        while len(self._buffer) < n and not self._exhausted:
+            try:
+                self._buffer.append(next(self.rows))
+            except StopIteration:
+                self._exhausted = True
+        return self._buffer
+
+    def _table(self, rows, last):
+        data = [self.header] + rows
+        style = list(self.style)
+        if last:
+            data.append(self.total)
+            style.extend(self.totalStyle)
+        return Table(data, colWidths=self.colWidths, style=style)
+
+    def _measure(self):
+        # (header, row, total) heights
+        if self._heights is None:
+            sample = self._fill(1)[:1] or [[''] * len(self.header)]
+            header = self._table([], False).wrap(0, 0)[1]
+            row = self._table(sample, False).wrap(0, 0)[1] - header
+            total = self._table(sample, True).wrap(0, 0)[1] - header - row
+            self._heights = header, row, total
+        return self._heights
+
+    def _capacity(self, availHeight):
+        header, row, total = self._measure()
+        return max(0, int((availHeight - header) // row))
+
+    def wrap(self, availWidth, availHeight):
+        header, row, total = self._measure()
+        rows = self._fill(self._capacity(availHeight) + 1)
+        self.width = sum(self.colWidths)
+        self.height = header + len(rows) * row + total
+        if not self._exhausted:
+            # More rows than fit here, asks the frame to split
+            self.height = max(self.height, availHeight + 1)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        capacity = self._capacity(availHeight)
+        n = min(capacity, len(self._fill(capacity + 1)))
+        if self._exhausted and n == len(self._buffer):
+            n -= 1  # every row fits but the total does not, keep one back for it
+        if n <= 0:
+            return []
+        # A new flowable for the rest, like Table.split; platypus marks the
+        # ones it had to postpone
+        rest = StreamingTable(self.header, self.rows, self.total, self.colWidths, self.style, self.totalStyle)
+        rest._buffer = self._buffer[n:]
+        rest._exhausted = self._exhausted
+        rest._heights = self._heights
+        return [self._table(self._buffer[:n], False), rest]
+
+    def draw(self):
+        table = self._table(self._buffer, True)
+        table.wrap(self.width, self.height)
+        table.drawOn(self.canv, 0, 0)
+
+
+class PageCache:
+    """Content streams of story segments laid out by earlier builds.
+
+    A segment is the run of pages from a SegmentStart to the next one. Its
+    pages are stored as recorded, before header and footer are drawn, so a
+    later build can replay them with CachedPage instead of laying the
+    segment out again. The least recently used segments are dropped once
+    more than maxSegments are held.
+    """
+
+    def __init__(self, maxSegments=5000):
+        self.maxSegments = maxSegments
+        self.hits = 0
+        self.misses = 0
+        self._segments = OrderedDict()
+
+    def get(self, key):
+        pages = self._segments.get(key)
+        if pages is None:
+            self.misses += 1
+            return None
+        self._segments.move_to_end(key)
+        self.hits += 1
+        return pages
+
+    def put(self, key, pages):
+        self._segments[key] = pages
+        self._segments.move_to_end(key)
+        while len(self._segments) > self.maxSegments:
+            self._segments.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'segments': len(self._segments)}
+
+
+class SegmentStart(Flowable):
+    """Zero-size marker; the pages that follow, up to the next marker, are
+    recorded into cache under key. key=None just closes the open segment.
+
+    Must come first on a page, i.e. after a PageBreak or at the story start.
+    """
+
+    def __init__(self, key=None, cache=None):
+        Flowable.__init__(self)
+        self.key = key
+        self.cache = cache
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        self.canv.beginSegment(self.key, self.cache)
+
+
+class CachedPage(Flowable):
+    """Replays one page recorded in a PageCache. Follow it with a PageBreak.
+
+    photo is the PhotoStream drawn on the page, if any.
+    """
+
+    def __init__(self, page, photo=None):
+        Flowable.__init__(self)
+        self.page = page
+        self.photo = photo
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        # The recorded operators are in page space, not frame space
+        canvas.replayPage(self.page, self.photo)
+
+
+class LazyStory(list):
+    """Story that pulls its flowables from an iterator as layout uses them up.
+
+    platypus only works on the front of the story list and deletes each
+    flowable once it is placed, so no more than ahead flowables, about a
+    page, are held at a time. What ends up in the document, every page
+    stream and embedded image included, is still held until it is saved;
+    see PhotoStream for keeping photos out of the story as well. Needs
+    ProgressDocTemplate.build; multiBuild copies the whole story for
+    every pass. estimate, if known, is the expected number of flowables,
+    for progress reports.
+    """
+
+    def __init__(self, flowables, ahead=16, estimate=None):
+        list.__init__(self)
+        self.source = iter(flowables)
+        self.ahead = ahead
+        self.estimate = estimate
+        self.pulled = 0
+        self.exhausted = False
+
+    def refill(self):
+        while len(self) < self.ahead and not self.exhausted:
+            try:
+                self.append(next(self.source))
+            except StopIteration:
+                self.exhausted = True
+            else:
+                self.pulled += 1
+
+    @property
+    def total(self):
+        if self.exhausted or self.estimate is None:
+            return self.pulled
+        return max(self.estimate, self.pulled)
+
+
+class ProgressDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate that reports layout and save progress to a BuildMonitor.
+
+    The monitor's cancel token is checked between flowables and pages. Its
+    canvas gets the monitor too, for the phases timed while drawing. build
+    also takes a LazyStory, which it refills while laying it out; the time
+    spent making its flowables is timed as STORY.
+    """
+
+    def __init__(self, filename, monitor=None, **kw):
+        SimpleDocTemplate.__init__(self, filename, **kw)
+        self.monitor = monitor or BuildMonitor()
+        self.storyLength = 0
+        self.flowablesDone = 0
+        self.lazyStory = None
+        self.setProgressCallBack(self._onBuildProgress)
+
+    def build(self, flowables, **kw):
+        self.lazyStory = flowables if isinstance(flowables, LazyStory) else None
+        if self.lazyStory is not None:
+            with self.monitor.phase(STORY):
+                self.lazyStory.refill()
+        SimpleDocTemplate.build(self, flowables, **kw)
+
+    def _makeCanvas(self, filename=None, canvasmaker=canvas.Canvas):
+        canv = SimpleDocTemplate._makeCanvas(self, filename, canvasmaker)
+        canv.monitor = self.monitor
+        return canv
+
+    def handle_flowable(self, flowables):
+        self.monitor.count('flowables')
+        SimpleDocTemplate.handle_flowable(self, flowables)
+        # Topped up half a queue at a time
+        if flowables is self.lazyStory and len(flowables) < flowables.ahead // 2:
+            with self.monitor.phase(STORY):
+                flowables.refill()
+
+    def _onBuildProgress(self, typ, value):
+        if typ == 'SIZE_EST':
+            self.storyLength = value if self.lazyStory is None else self.lazyStory.total
+        elif typ == 'PROGRESS':
+            if self.lazyStory is not None:
+                # build only counts down the flowables it was started with
+                value = self.lazyStory.pulled - len(self.lazyStory)
+                self.storyLength = self.lazyStory.total
+            self.flowablesDone = value
+            self.monitor.report(LAYOUT, self.page, value, self.storyLength)
+        elif typ == 'PAGE':
+            self.monitor.report(LAYOUT, value, self.flowablesDone, self.storyLength)
+
+    def _endBuild(self):
+        # Close the last page, report, and only then save. multiBuild clears
+        # _doSave and saves by itself once its passes are done.
+        doSave = getattr(self, '_doSave', 1)
+        self._doSave = 0
+        SimpleDocTemplate._endBuild(self)
+        self._doSave = doSave
+        self.monitor.report(SAVE, self.canv.getPageNumber() - 1, self.flowablesDone, self.storyLength)
+        if doSave:
+            self.canv.save()
+
+
+class FooterCanvas(canvas.Canvas):
+
+    # Each page is written out as soon as it is finished. The total page
+    # count is unknown until save(), so every footer points at a shared form
+    # that is only filled in once the last page has been emitted.
+    pageCountForm = 'pageCount'
+    # Header artwork is drawn once into this form and reused by every page
+    headerForm = 'pageHeader'
+    footerFont = ('Times-Roman', 10)
+
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self.width, self.height = LETTER
+        # (key, cache, pages) of the segment being recorded, see SegmentStart.
+        # pages is None once the segment turns out not to be replayable.
+        self._segment = None
+        self._pagePhotos = []
+        # Replaced by ProgressDocTemplate with the build's own
+        self.monitor = BuildMonitor()
+
+    def showPage(self):
+        if self._segment:
+            self.recordPage()
+        self._pagePhotos = []
+        if (self._pageNumber > 1):
+            with self.monitor.phase(FOOTER):
+                self.draw_canvas()
+        canvas.Canvas.showPage(self)
+
+    def save(self):
+        if len(self._code):
+            self.showPage()
+        self.beginSegment(None)
+        with self.monitor.phase(FOOTER):
+            if self._pageNumber > 2:
+                self.draw_header()
+            page_count = self._pageNumber - 1
+            self.beginForm(self.pageCountForm)
+            self.setFont(*self.footerFont)
+            self.drawString(0, 0, str(page_count))
+            self.endForm()
+        # Serialising the objects, page streams compressed on the way
+        with self.monitor.phase(SAVE):
+            canvas.Canvas.save(self)
+        self.monitor.count('pages', page_count)
+        if isinstance(self._filename, str):
+            self.monitor.count('bytes', os.path.getsize(self._filename))
+        elif hasattr(self._filename, 'tell'):
+            self.monitor.count('bytes', self._filename.tell())
+
+    def drawCachedImage(self, path, x, y, width=None, height=None, mask=None, preserveAspectRatio=False,
+                        anchor='c'):
+        """Like drawImage, but the XObject comes from the process-wide cache."""
+        with self.monitor.phase(EMBED):
+            self._drawCachedImage(path, x, y, width, height, mask, preserveAspectRatio, anchor)
+
+    def _drawCachedImage(self, path, x, y, width, height, mask, preserveAspectRatio, anchor):
+        template = cachedImage(path, mask)
+        regName = self._doc.getXObjectName(template.name)
+        imgObj = self._doc.idToObject.get(regName, None)
+        if not imgObj:
+            # Per-document shallow copies; registering an object stamps it with
+            # that document's internal name. The stream bytes are still shared.
+            imgObj = copy.copy(template)
+            self._doc.Reference(imgObj, regName)
+            self._doc.addForm(template.name, imgObj)
+            self.monitor.count('images')
+            smask = getattr(template, '_smask', None)
+            if smask:
+                mRegName = self._doc.getXObjectName(smask.name)
+                if not self._doc.idToObject.get(mRegName, None):
+                    imgObj.smask = self._doc.Reference(copy.copy(smask), mRegName)
+                else:
+                    imgObj.smask = pdfdoc.PDFObjectReference(mRegName)
+                del imgObj._smask
+
+        x, y, width, height, scaled = aspectRatioFix(preserveAspectRatio, anchor, x, y, width, height,
+                                                     imgObj.width, imgObj.height)
+        self._drawXObject(template.name, x, y, width, height)
+
+    def drawPhoto(self, name, x, y, width, height):
+        """Draw a JPEG stream added with registerPhoto."""
+        self._currentPageHasImages = 1
+        self._pagePhotos.append(name)
+        self._drawXObject(name, x, y, width, height)
+
+    def registerPhoto(self, name, data):
+        # Every stream with the same name is written once per document
+        regName = self._doc.getXObjectName(name)
+        if not self._doc.idToObject.get(regName, None):
+            imgObj = pdfdoc.PDFImageXObject(name)
+            imgObj.loadImageFromJPEG(io.BytesIO(data))
+            self._doc.Reference(imgObj, regName)
+            self._doc.addForm(name, imgObj)
+            self.monitor.count('images')
+
+    def beginSegment(self, key, cache=None):
+        if self._segment:
+            oldKey, oldCache, pages = self._segment
+            if pages:
+                oldCache.put(oldKey, pages)
+        self._segment = (key, cache, []) if key is not None else None
+
+    def recordPage(self):
+        key, cache, pages = self._segment
+        if pages is None:
+            return
+        # Only text, vector graphics and one photo can be replayed; anything
+        # else needs resources that live outside the content stream
+        photos = set(self._pagePhotos)
+        recorded = photos.union(*(page['photos'] for page in pages))
+        if (set(self._formsinuse) - photos or len(recorded) > 1 or self._annotationrefs
+                or any(_pageResources.search(op) for op in self._code)):
+            self._segment = (key, cache, None)
+            return
+        fontNames = dict((internal, name) for name, internal in self._doc.fontMapping.items())
+        fonts = dict((internal, fontNames[internal])
+                     for op in self._code for internal, _ in _fontSelection.findall(op))
+        pages.append({'code': list(self._code), 'fonts': fonts, 'photos': sorted(photos)})
+
+    def replayPage(self, page, photo=None):
+        # Font and XObject names are per document, map them onto this one's
+        rename = {}
+        for internal, fontName in page['fonts'].items():
+            rename[internal] = self._doc.getInternalFontName(fontName)
+        photos = {}
+        for name in page['photos']:
+            with self.monitor.phase(EMBED):
+                newName = photo.register(self)
+            self._formsinuse.append(newName)
+            self._pagePhotos.append(newName)
+            photos[self._doc.getXObjectName(name)] = self._doc.getXObjectName(newName)
+        code = page['code']
+        if rename or photos:
+            code = [self._replayOp(op, rename, photos) for op in code]
+        if photos:
+            self._currentPageHasImages = 1
+        self._code.extend(code)
+
+    @staticmethod
+    def _replayOp(op, fonts, photos):
+        op = _fontSelection.sub(lambda m: fonts.get(m.group(1), m.group(1)) + m.group(2), op)
+        if op.endswith(' Do'):
+            name = op[1:-3]
+            op = '/%s Do' % photos.get(name, name)
+        return op
+
+    def _drawXObject(self, name, x, y, width, height):
+        self.saveState()
+        self.translate(x, y)
+        self.scale(width, height)
+        self._code.append("/%s Do" % self._doc.getXObjectName(name))
+        self.restoreState()
+        self._formsinuse.append(name)
+
+    def draw_header(self):
+        self.beginForm(self.headerForm)
+        self.drawCachedImage("static/lr.png", self.width - inch * 8 - 5, self.height - 50, width=100, height=20,
+                             preserveAspectRatio=True)
+        self.drawCachedImage("static/ohka.png", self.width - inch * 2, self.height - 50, width=100, height=30,
+                             preserveAspectRatio=True, mask='auto')
+        self.endForm()
+
+    def draw_canvas(self):
+        page = "Page %s of " % self._pageNumber
+        x = 128
+        self.saveState()
+        self.setStrokeColorRGB(0, 0, 0)
+        self.setLineWidth(0.5)
+        self.doForm(self.headerForm)
+        self._currentPageHasImages = 1
+        self.line(30, 740, LETTER[0] - 50, 740)
+        self.line(66, 78, LETTER[0] - 66, 78)
+        self.setFont(*self.footerFont)
+        self.drawString(LETTER[0] - x, 65, page)
+        # Late-bound total, drawn right after "Page X of "
+        self.translate(LETTER[0] - x + stringWidth(page, *self.footerFont), 65)
+        self.doForm(self.pageCountForm)
+        self.restoreState()
@@ -0,0 +1,238 @@
+"""
+Resident report server for the local user.
+
+    python reportdaemon.py --output-dir ~/reports
+    curl --unix-socket ~/.portfoliolio/reportdaemon.sock --data @job.json \\
+         -H 'Content-Type: application/json' http://localhost/report
+
+Startup imports ReportLab and does one throwaway build, which leaves the
+styles, font metrics and the header and logo images in memory (see
+reportcanvas.cachedImage). Every request is then served by a child forked
+from that warm process, so it only pays for its own layout.
+
+    POST /report   a batch.py job as an application/json body. Without
+                   "output" the PDF is the response body; with it the file
+                   is written atomically and the batch result comes back
+                   as JSON.
+    GET /health    'ok'
+
+By default the server listens on a Unix socket only its owner can open,
+which no web page can reach. --port serves HTTP on localhost instead;
+every POST then needs an "Authorization: Bearer <token>" header with the
+token written to --token-file at startup. Either way "output" and
+"trace" paths must lie inside --output-dir, and jobs that name them are
+refused when it is not set.
+
+Platforms without fork serve one request at a time from the warm process.
+"""
+import argparse
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+import stat
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ForkingMixIn
+
+from batch import buildReport, jobFlag, runJob
+from buildcontrol import BuildTrace
+
+defaultSocket = os.path.join(os.path.expanduser('~'), '.portfoliolio', 'reportdaemon.sock')
+defaultTokenFile = os.path.join(os.path.expanduser('~'), '.portfoliolio', 'reportdaemon.token')
+# Job fields the daemon writes to
+_outputFields = ('output', 'trace')
+
+
+def warm():
+    started = time.perf_counter()
+    buildReport({'kind': 'timesheet'}, io.BytesIO())
+    return time.perf_counter() - started
+
+
+def insideDirectory(path, directory):
+    """path resolved against directory, or None when it ends up outside it."""
+    directory = os.path.realpath(directory)
+    resolved = os.path.realpath(os.path.join(directory, path))
+    if os.path.commonpath([resolved, directory]) != directory:
+        return None
+    return resolved
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, 'text/plain', b'ok\n')
+        else:
+            self.reply(404, 'text/plain', b'not found\n')
+
+    def do_POST(self):
+        if self.path != '/report':
+            self.reply(404, 'text/plain', b'not found\n')
+            return
+        # A page can only send text/plain, form or multipart bodies to
+        # localhost without a preflight, and never an Authorization header
+        token = self.server.token
+        if token is not None and not hmac.compare_digest(self.headers.get('Authorization', ''),
+                                                         'Bearer ' + token):
+            self.reply(401, 'text/plain', b'missing or wrong token\n')
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self.reply(415, 'text/plain', b'jobs must be sent as application/json\n')
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(job, dict):
+                raise ValueError('a job is a JSON object')
+        except ValueError as e:
+            self.reply(400, 'text/plain', ('bad job: %s\n' % e).encode('utf-8'))
+            return
+        for field in _outputFields:
+            if not job.get(field):
+                continue
+            path = None
+            if self.server.outputDir is not None:
+                path = insideDirectory(job[field], self.server.outputDir)
+            if path is None:
+                self.reply(403, 'text/plain', ('%s must be inside --output-dir\n' % field).encode('utf-8'))
+                return
+            job[field] = path
+
+        if job.get('output'):
+            result = runJob(job)
+            self.reply(200 if result['ok'] else 500, 'application/json', json.dumps(result).encode('utf-8'))
+            return
+
+        started = time.perf_counter()
+        pdf = io.BytesIO()
+        trace = BuildTrace(memory=jobFlag(job, 'memory')) if job.get('trace') else None
+        try:
+            pages = buildReport(job, pdf, trace)
+        except Exception as e:
+            self.reply(500, 'text/plain', ('%s: %s\n' % (type(e).__name__, e)).encode('utf-8'))
+            return
+        finally:
+            if trace is not None:
+                trace.stop()
+                trace.writeTrace(job['trace'])
+        self.reply(200, 'application/pdf', pdf.getvalue(),
+                   {'X-Pages': pages, 'X-Seconds': '%.3f' % (time.perf_counter() - started)})
+
+    def reply(self, status, contentType, body, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+# One child per request, forked from the warmed parent. Without fork,
+# requests are served in turn by the warmed process.
+_serving = (ForkingMixIn,) if hasattr(os, 'fork') else ()
+
+
+class ReportServer(*_serving, HTTPServer):
+    """HTTP on a TCP port; needs a token, see the module docstring."""
+
+    token = None
+    outputDir = None
+
+
+if hasattr(socket, 'AF_UNIX'):
+    from socketserver import UnixStreamServer
+
+    class UnixReportServer(*_serving, UnixStreamServer):
+        """HTTP on a Unix socket that only its owner can connect to."""
+
+        token = None
+        outputDir = None
+
+        def server_bind(self):
+            path = self.server_address
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            try:
+                isSocket = stat.S_ISSOCK(os.lstat(path).st_mode)
+            except FileNotFoundError:
+                isSocket = False
+            if isSocket:
+                probe = socket.socket(socket.AF_UNIX)
+                try:
+                    probe.connect(path)
+                except OSError:
+                    # Left behind by a daemon that did not shut down cleanly
+                    os.remove(path)
+                else:
+                    raise OSError('a report daemon is already listening on %s' % path)
+                finally:
+                    probe.close()
+            umask = os.umask(0o177)
+            try:
+                UnixStreamServer.server_bind(self)
+            finally:
+                os.umask(umask)
+
+        def server_close(self):
+            UnixStreamServer.server_close(self)
+            try:
+                os.remove(self.server_address)
+            except FileNotFoundError:
+                pass
+
+
+def writeToken(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, 0o600)  # an older file may have been readable by others
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    return token
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve timesheets and portfolios from a warm process.')
+    parser.add_argument('--socket', default=defaultSocket,
+                        help='Unix socket to listen on (default: %(default)s)')
+    parser.add_argument('-p', '--port', type=int,
+                        help='serve HTTP on this localhost port instead, with a token')
+    parser.add_argument('--host', default='127.0.0.1', help='address for --port (default: %(default)s)')
+    parser.add_argument('--token-file', default=defaultTokenFile,
+                        help='where --port writes the token clients must send (default: %(default)s)')
+    parser.add_argument('-o', '--output-dir',
+                        help='directory jobs may write "output" and "trace" files in (default: none)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='most requests built at once (default: CPU count)')
+    args = parser.parse_args(argv)
+    if args.port is None and not hasattr(socket, 'AF_UNIX'):
+        parser.error('Unix sockets are not available here, use --port')
+
+    print('Warming up... %.2fs' % warm())
+    if args.port is None:
+        server = UnixReportServer(args.socket, ReportHandler)
+        print('Listening on %s' % args.socket)
+    else:
+        server = ReportServer((args.host, args.port), ReportHandler)
+        server.token = writeToken(args.token_file)
+        print('Listening on http://%s:%d, token in %s' % (server.server_address[:2] + (args.token_file,)))
+    server.outputDir = args.output_dir
+    server.max_children = args.workers
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
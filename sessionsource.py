@@ -0,0 +1,273 @@
+import csv
+import sqlite3
+from array import array
+from collections import namedtuple
+from datetime import date as Date
+
+import numpy as np
+
+# Report sections, in the order PDFPSReporte lays them out. Any other
+# session type is reported under OTHER.
+REMOTE = 'remote'
+ONSITE = 'onsite'
+OTHER = 'other'
+SECTIONS = (REMOTE, ONSITE, OTHER)
+_sectionIndex = dict((section, i) for i, section in enumerate(SECTIONS))
+
+_weekdays = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+_shortMonths = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+_months = ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre',
+           'octubre', 'noviembre', 'diciembre']
+
+
+class Session(namedtuple('Session', 'client date start end type')):
+    """One timesheet entry. date is a datetime.date, start and end are 'HH:MM'."""
+
+    __slots__ = ()
+
+    @property
+    def section(self):
+        return self.type if self.type in (REMOTE, ONSITE) else OTHER
+
+    @property
+    def minutes(self):
+        # Sessions that run past midnight end on the next day
+        return (parseMinutes(self.end) - parseMinutes(self.start)) % (24 * 60)
+
+
+def parseMinutes(text):
+    hours, minutes = text.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def formatMinutes(minutes):
+    # 114 -> '1:54', totals may run past 24 hours: 1815 -> '30:15'
+    return '%d:%02d' % divmod(minutes, 60)
+
+
+def formatHours(minutes):
+    # Summary totals, '00:00' style and signed once more hours are
+    # consumed than were contracted
+    sign = '-' if minutes < 0 else ''
+    return '%s%02d:%02d' % ((sign,) + divmod(abs(minutes), 60))
+
+
+def formatDate(day):
+    return '%s, %d de %s de %d' % (_weekdays[day.weekday()], day.day, _months[day.month - 1], day.year)
+
+
+def formatShortDate(day):
+    # '23-Oct-2019'
+    return '%02d-%s-%d' % (day.day, _shortMonths[day.month - 1], day.year)
+
+
+def formatLongDate(day):
+    # '01-Abril-2020'
+    return '%02d-%s-%d' % (day.day, _months[day.month - 1].capitalize(), day.year)
+
+
+def sessionRows(sessions):
+    """Table rows (No., Fecha, Hora Inicio, Hora Fin, Tiempo Total) for sessions, lazily."""
+    for lineNum, session in enumerate(sessions, 1):
+        yield [str(lineNum), formatDate(session.date), session.start, session.end,
+               formatMinutes(session.minutes)]
+
+
+class SessionTotals:
+    """Minutes per section and overall, see sessionTotals."""
+
+    def __init__(self, bySection):
+        self.bySection = bySection
+        self.consumed = sum(bySection.values())
+
+    def remaining(self, contracted):
+        return contracted - self.consumed
+
+
+def sessionTotals(sessions, chunkSize=65536):
+    """
+    Sum session durations per section in one pass over sessions.
+
+    Start and end times are collected into integer-minute arrays a chunk
+    at a time; durations and per-section sums are computed on whole
+    chunks, so memory stays at one chunk however long the source is.
+    """
+    totals = np.zeros(len(SECTIONS), dtype=np.int64)
+    sections, starts, ends = array('b'), array('i'), array('i')
+    for session in sessions:
+        sections.append(_sectionIndex[session.section])
+        starts.append(parseMinutes(session.start))
+        ends.append(parseMinutes(session.end))
+        if len(sections) == chunkSize:
+            totals += _sumChunk(sections, starts, ends)
+            sections, starts, ends = array('b'), array('i'), array('i')
+    totals += _sumChunk(sections, starts, ends)
+    return SessionTotals(dict(zip(SECTIONS, (int(t) for t in totals))))
+
+
+def _sumChunk(sections, starts, ends):
+    minutes = (np.frombuffer(ends, dtype=np.int32) - np.frombuffer(starts, dtype=np.int32)) % (24 * 60)
+    sums = np.zeros(len(SECTIONS), dtype=np.int64)
+    np.add.at(sums, np.frombuffer(sections, dtype=np.int8), minutes)
+    return sums
+
+
+class SampleSessionSource:
+    """Ten identical sessions per section, for the demo report."""
+
+    client = 'Nombre del Cliente'
+    since = Date(2019, 10, 23)
+    until = Date(2020, 4, 1)
+
+    def sessions(self, section):
+        for row in range(10):
+            yield Session(self.client, Date(2019, 12, 11), '17:30', '19:24', section)
+
+    def allSessions(self):
+        for section in SECTIONS:
+            yield from self.sessions(section)
+
+
+class CSVSessionSource:
+    """
+    Sessions read from a CSV file with a client,date,start,end,type header.
+
+    The file is read again for every section and never held in memory;
+    rows keep the file's order. client, since and until (inclusive dates)
+    narrow it down to one client and period, row by row. Use a
+    SessionStore to answer those queries from an index instead.
+    """
+
+    def __init__(self, path, client=None, since=None, until=None):
+        self.path = path
+        self.client = client
+        self.since = since
+        self.until = until
+
+    def sessions(self, section):
+        for session in self.allSessions():
+            if session.section == section:
+                yield session
+
+    def allSessions(self):
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if self.client is not None and row['client'] != self.client:
+                    continue
+                session = Session(row['client'], Date.fromisoformat(row['date']), row['start'], row['end'],
+                                  row['type'])
+                if self.since is not None and session.date < self.since:
+                    continue
+                if self.until is not None and session.date > self.until:
+                    continue
+                yield session
+
+
+class SQLiteSessionSource:
+    """
+    Sessions read from the sessions table of a SQLite database, columns as
+    in CSVSessionSource with date stored as 'YYYY-MM-DD'.
+
+    Each section is one query, fetched arraysize rows at a time and
+    ordered by date and start time. client, since and until become part
+    of the WHERE clause, which the SessionStore indexes serve.
+    """
+
+    arraysize = 1000
+
+    def __init__(self, path, client=None, since=None, until=None):
+        self.path = path
+        self.client = client
+        self.since = since
+        self.until = until
+
+    def sessions(self, section):
+        if section == OTHER:
+            where, args = ['type NOT IN (?, ?)'], [REMOTE, ONSITE]
+        else:
+            where, args = ['type = ?'], [section]
+        return self._query(where, args, 'ORDER BY date, start')
+
+    def allSessions(self):
+        # Totals need every row once, in any order
+        return self._query([], [], '')
+
+    def _query(self, where, args, order):
+        if self.client is not None:
+            where.append('client = ?')
+            args.append(self.client)
+        if self.since is not None:
+            where.append('date >= ?')
+            args.append(self.since.isoformat())
+        if self.until is not None:
+            where.append('date <= ?')
+            args.append(self.until.isoformat())
+        query = 'SELECT client, date, start, "end", type FROM sessions'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute('%s %s' % (query, order), args)
+            while True:
+                rows = cursor.fetchmany(self.arraysize)
+                if not rows:
+                    break
+                for client, day, start, end, type in rows:
+                    yield Session(client, Date.fromisoformat(day), start, end, type)
+        finally:
+            connection.close()
+
+
+class SessionStore:
+    """
+    SQLite file holding the sessions of every client.
+
+    Indexed on (client, type, date) for a client's report sections,
+    (client, date) for its totals and (date) for reports across clients,
+    so a client and period only reads matching rows.
+    """
+
+    schema = [
+        'CREATE TABLE IF NOT EXISTS sessions (client TEXT NOT NULL, date TEXT NOT NULL, start TEXT NOT NULL, '
+        '"end" TEXT NOT NULL, type TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS sessions_client_type_date ON sessions (client, type, date, start)',
+        'CREATE INDEX IF NOT EXISTS sessions_client_date ON sessions (client, date, start)',
+        'CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date)',
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            for statement in self.schema:
+                self.connection.execute(statement)
+
+    def add(self, sessions, batch=10000):
+        # sessions may be any iterable of Session, inserted a batch at a time
+        insert = 'INSERT INTO sessions (client, date, start, "end", type) VALUES (?, ?, ?, ?, ?)'
+        rows = []
+        with self.connection:
+            for session in sessions:
+                rows.append((session.client, session.date.isoformat(), session.start, session.end, session.type))
+                if len(rows) == batch:
+                    self.connection.executemany(insert, rows)
+                    rows = []
+            self.connection.executemany(insert, rows)
+
+    def importCSV(self, path):
+        self.add(CSVSessionSource(path).allSessions())
+
+    def clients(self):
+        return [client for client, in self.connection.execute('SELECT DISTINCT client FROM sessions ORDER BY client')]
+
+    def source(self, client=None, since=None, until=None):
+        return SQLiteSessionSource(self.path, client, since, until)
+
+    def close(self):
+        self.connection.close()
+
+
+def openSessionSource(path, client=None, since=None, until=None):
+    if path.lower().endswith('.csv'):
+        return CSVSessionSource(path, client, since, until)
+    return SQLiteSessionSource(path, client, since, until)
@@ -0,0 +1,57 @@
+"""
+Check how long Portfoliolio takes to show its window.
+
+    python startuptime.py [--top 15]
+
+Runs `port.py --startup-time` under `python -X importtime`, prints the
+app's own phase timings and the slowest top-level imports, and exits
+non-zero when the first paint misses port.startup_budget. Set
+QT_QPA_PLATFORM=offscreen to run it without a display.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# "import time: self [us] | cumulative | imported package", nested imports
+# are indented by two spaces per level
+_importLine = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+_firstPaint = re.compile(r'first paint ([\d.]+)s \(budget ([\d.]+)s\)')
+
+
+def measure(script):
+    result = subprocess.run([sys.executable, '-X', 'importtime', script, '--startup-time'],
+                            cwd=os.path.dirname(script), capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        m = _importLine.match(line)
+        if m and not m.group(3):
+            imports.append((int(m.group(2)), int(m.group(1)), m.group(4)))
+    return result.stdout, imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure Portfoliolio start-up against its budget.')
+    parser.add_argument('--top', type=int, default=15, help='top-level imports to list (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    stdout, imports = measure(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'port.py'))
+    print(stdout.strip())
+    print('%10s %10s  %s' % ('cumul ms', 'self ms', 'top-level import'))
+    for cumulative, own, name in sorted(imports, reverse=True)[:args.top]:
+        print('%10.1f %10.1f  %s' % (cumulative / 1000.0, own / 1000.0, name))
+
+    m = _firstPaint.search(stdout)
+    if not m:
+        print('port.py did not report its start-up time')
+        return 2
+    painted, budget = float(m.group(1)), float(m.group(2))
+    if painted > budget:
+        print('Over budget by %.3fs' % (painted - budget))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())